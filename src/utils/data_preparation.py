@@ -13,22 +13,370 @@ for each algorithm, this function is created to automate the process and make co
 """
 
 
+from collections import OrderedDict,namedtuple
+import numpy as np
 import pandas as pd
-import re
+from joblib import Parallel,delayed
+
+# numba is optional, without it the mean imputation falls back to numpy
+try:
+    from numba import njit,prange
+except ImportError:
+    njit = None
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
-from copy import deepcopy
 
 import sys
 sys.path.append("../")
 from utils.get_parameters import get_combinations
 
-def balance_impute_data(balancer,imputer,data_path=None,df=None,test_size=.2,target='CVD'):
+
+# the output of balance_impute_data and prepare_for_algorithm, it can still be unpacked as a 7-tuple
+PreparedData = namedtuple('PreparedData','X_train X_test y_train y_test cat_imputer_name num_imputer_name balancer_name')
+
+# prepared data by (id(df), num imputer name, cat imputer name, balancer), see _prepare_cached
+_PREPARED_CACHE = OrderedDict()
+_PREPARED_CACHE_SIZE = 16
+
+
+
+if njit is not None:
+    
+    # fastmath is not used: it lets numba assume there are no NaNs, which would break the isnan checks
+    @njit(parallel=True,cache=True)
+    def _impute_mean_numba(x):
+        
+        """
+        One sweep per column (columns in parallel): sum the non-missing values, then fill the missing ones with the mean.
+        Returns the number of non-missing values of each column; a column with none is left as it is (see impute_mean_inplace).
+        """
+        
+        observed = np.zeros(x.shape[1],dtype=np.int64)
+        
+        for j in prange(x.shape[1]):
+            
+            s = 0.
+            n = 0
+            
+            for i in range(x.shape[0]):
+                v = x[i,j]
+                if not np.isnan(v):
+                    s += v
+                    n += 1
+                    
+            observed[j] = n
+            
+            # nothing to fill the column with, impute_mean_inplace raises for it
+            if n == 0:
+                continue
+            
+            m = s/n
+            
+            for i in range(x.shape[0]):
+                if np.isnan(x[i,j]):
+                    x[i,j] = m
+                    
+        return observed
+
+
+
+def _check_not_empty(empty,columns=None):
+    
+    """
+    Raises a ValueError naming the columns that have no observed values (empty is a boolean mask over the columns).
+    Such columns cannot be imputed by the mean or mode fast paths.
+    """
+    
+    if empty.any():
+        
+        positions = np.flatnonzero(empty)
+        names = [columns[j] for j in positions] if columns is not None else list(positions)
+        
+        raise ValueError(f"Cannot impute column(s) {names}: all values are missing.")
+
+
+
+def impute_mean_inplace(x,columns=None):
+    
+    """
+    Fills the missing values of each column with the column mean, in place.
+    Same result as SimpleImputer(strategy='mean') without allocating a new array.
+    If numba is installed, a compiled parallel kernel is used, otherwise numpy.
+    
+    Parameters:
+    -----------
+    x: np.array
+        2D float array with missing values as np.nan. It is modified in place.
+        
+    columns: list
+        The column names, used in the error message. The default value is None (positions are used).
+        
+    Raises:
+    -------
+    ValueError
+        If a column has no observed values.
+        
+    Returns:
+    --------
+    np.array
+        The same array, imputed.
+    """
+    
+    if njit is not None:
+        _check_not_empty(_impute_mean_numba(x) == 0,columns)
+        return x
+    
+    missing = np.isnan(x)
+    _check_not_empty(missing.all(axis=0),columns)
+    
+    means = np.nanmean(x,axis=0)
+    rows,cols = np.where(missing)
+    x[rows,cols] = np.take(means,cols)
+    
+    return x
+
+
+
+def impute_mode_inplace(x,columns=None):
+    
+    """
+    Fills the missing values of each column with the most frequent value of the column, in place.
+    Same result as SimpleImputer(strategy='most_frequent'): on ties the smallest value is used.
+    
+    Parameters:
+    -----------
+    x: np.array
+        2D float array with missing values as np.nan. It is modified in place.
+        
+    columns: list
+        The column names, used in the error message. The default value is None (positions are used).
+        
+    Raises:
+    -------
+    ValueError
+        If a column has no observed values.
+        
+    Returns:
+    --------
+    np.array
+        The same array, imputed.
+    """
+    
+    missing = np.isnan(x)
+    _check_not_empty(missing.all(axis=0),columns)
+    
+    for j in range(x.shape[1]):
+        
+        column = x[:,j]
+        
+        if not missing[:,j].any():
+            continue
+        
+        # np.unique returns sorted values, so argmax picks the smallest of the most frequent ones
+        values,counts = np.unique(column[~missing[:,j]],return_counts=True)
+        column[missing[:,j]] = values[np.argmax(counts)]
+    
+    return x
+
+
+
+# imputers that have a numpy in-place equivalent, by the name used in the imputer lists
+_FAST_IMPUTERS = {
+    'SimpleImputer_mean':impute_mean_inplace,
+    'SimpleImputer_mode':impute_mode_inplace
+}
+
+
+
+def _impute(x,imputer_name,imputer,columns=None):
+    
+    """
+    Imputes x with the numpy fast path if there is one for imputer_name, otherwise with the sklearn imputer.
+    x must be owned by the caller since the fast path works in place. columns are the names used in the fast path errors.
+    """
+    
+    if imputer_name in _FAST_IMPUTERS:
+        return _FAST_IMPUTERS[imputer_name](x,columns)
+    
+    return imputer.fit_transform(x)
+
+
+
+def read_data(data_path):
+    
+    """
+    Reads the data without the time columns, death, and RANDID.
+    The csv is parsed with the multithreaded pyarrow engine if pyarrow is installed, otherwise with the default engine.
+    The columns keep the numpy dtypes, so the rest of the pipeline does not change.
+    
+    Parameters:
+    -----------
+    data_path: str
+        The path to the data.
+        
+    Returns:
+    --------
+    pd.DataFrame
+        The data.
+    """
+    
+    # the pyarrow engine does not accept a callable usecols, so the header is read first to get the column names
+    columns = pd.read_csv(data_path,nrows=0).columns
+    usecols = [col for col in columns if col not in ('RANDID','DEATH') and not col.startswith('TIME')]
+    
+    try:
+        return pd.read_csv(data_path,usecols=usecols,engine='pyarrow')
+    except ImportError:
+        return pd.read_csv(data_path,usecols=usecols)
+
+
+
+def _drop_unused_columns(df):
+    
+    """
+    Removes the time columns, death, and RANDID if they are in df.
+    """
+    
+    cols = df.columns.astype(str)
+    keep = ~cols.str.startswith('TIME') & ~cols.isin(('RANDID','DEATH'))
+    
+    return df.loc[:,keep]
+
+
+
+def split_columns(df,target='CVD'):
+    
+    """
+    Splits the features into categorical and numerical ones by the number of unique values.
+    If the unique values are less than 5, they are considered as categorical, if more than 5 numerical (this works only for this dataset, it is not a general rule).
+    
+    The data does not change between the algorithms, so the split can be computed once and passed to balance_impute_data (col_split).
+    
+    Parameters:
+    -----------
+    df: pd.DataFrame
+        The data.
+        
+    target: str
+        The target variable. The default value is 'CVD'
+        
+    Returns:
+    --------
+    tuple
+        The positions of the categorical, numerical, and remaining (exactly 5 unique values) features
+        in the feature columns of df (time columns, death, RANDID, and the target excluded).
+        (cat_idx,num_idx,rest_idx)
+    """
+    
+    df = _drop_unused_columns(df)
+    
+    n_uniques = df.drop(columns=target).nunique().to_numpy()
+    
+    return np.flatnonzero(n_uniques < 5),np.flatnonzero(n_uniques > 5),np.flatnonzero(n_uniques == 5)
+
+
+
+def split_and_scale(X,y,scale_idx,test_size=.2,random_state=123,chunk_size=8192):
+    
+    """
+    Splits the data into train and test sets (stratified by the target) and standardizes the columns in scale_idx 
+    with the mean and standard deviation of the train set, the same as StandardScaler.
+    The other columns are copied as they are and never rewritten.
+    
+    The rows are processed in chunks, so the float64 temporaries are at most chunk_size x len(scale_idx):
+        - train rows: gathered chunk by chunk, and the statistics of each (cache-hot) chunk are merged 
+          into the running mean and M2 with Chan's parallel Welford update
+        - train rows: the scale_idx columns are standardized in place
+        - test rows: gathered and standardized chunk by chunk
+    
+    Parameters:
+    -----------
+    X: np.array
+        The features.
+        
+    y: np.array
+        The target.
+        
+    scale_idx: np.array
+        The positions of the columns to scale.
+        
+    test_size: float
+        The size of the test set. The default value is .2
+        
+    random_state: int
+        The random state of the split. The default value is 123
+        
+    chunk_size: int
+        The number of rows processed at once. The default value is 8192
+        
+    Returns:
+    --------
+    tuple
+        (X_train,X_test,y_train,y_test)
+    """
+    
+    idx_train,idx_test = train_test_split(np.arange(len(y)),random_state=random_state,test_size=test_size,stratify=y)
+    
+    X_train = np.empty((len(idx_train),X.shape[1]),dtype=X.dtype)
+    X_test = np.empty((len(idx_test),X.shape[1]),dtype=X.dtype)
+    
+    # gather the train rows and compute the running mean and M2 of the scaled columns (float64 accumulators)
+    n = 0
+    mean = np.zeros(len(scale_idx),dtype=np.float64)
+    m2 = np.zeros(len(scale_idx),dtype=np.float64)
+    
+    for start in range(0,len(idx_train),chunk_size):
+        
+        rows = X_train[start:start+chunk_size]
+        rows[:] = X[idx_train[start:start+chunk_size]]
+        
+        block = rows[:,scale_idx].astype(np.float64)
+        n_block = len(block)
+        mean_block = block.mean(axis=0)
+        block -= mean_block
+        m2_block = np.einsum('ij,ij->j',block,block)
+        
+        delta = mean_block - mean
+        n_total = n + n_block
+        mean += delta * n_block / n_total
+        m2 += m2_block + delta**2 * n * n_block / n_total
+        n = n_total
+        
+    var = m2 / n
+    
+    # near constant columns are left unscaled, with the same rule as StandardScaler 
+    # (the error bound of the two-pass variance, computed with float64 accumulators)
+    eps = np.finfo(np.float64).eps
+    constant = var <= n*eps*var + (n*mean*eps)**2
+    
+    scale = np.sqrt(var)
+    scale[constant | (scale == 0)] = 1.
+    
+    mean,scale = mean.astype(X.dtype),scale.astype(X.dtype)
+    
+    # standardize the train rows in place, only the scaled columns are rewritten
+    for start in range(0,len(idx_train),chunk_size):
+        
+        rows = X_train[start:start+chunk_size]
+        rows[:,scale_idx] = (rows[:,scale_idx] - mean) / scale
+    
+    # gather and standardize the test rows
+    for start in range(0,len(idx_test),chunk_size):
+        
+        rows = X_test[start:start+chunk_size]
+        rows[:] = X[idx_test[start:start+chunk_size]]
+        rows[:,scale_idx] = (rows[:,scale_idx] - mean) / scale
+    
+    return X_train,X_test,y[idx_train],y[idx_test]
+
+
+
+def balance_impute_data(balancer,imputer,data_path=None,df=None,test_size=.2,target='CVD',col_split=None):
     
     
     """
     This function prepares data for modeling. 
     It reads the data, imputes the missing values, balances the data, scales the data, and splits the data into train and test sets.
+    Only the non-categorical features are scaled.
 
 
     Parameters:
@@ -49,23 +397,24 @@ def balance_impute_data(balancer,imputer,data_path=None,df=None,test_size=.2,tar
     target: str
         The target variable. The default value is 'CVD'
         
+    col_split: tuple
+        The positions of the categorical, numerical, and remaining features as returned by split_columns. The default value is None.
+        If None, the split is computed from df.
+        
     Returns:
     --------
-    tuple
-        A tuple with the train and test sets and the names of the imputers and balancer.  
+    PreparedData
+        A namedtuple with the train and test sets and the names of the imputers and balancer.  
         (X_train,X_test,y_train,y_test,cat_imputer_name,num_imputer_name,balancer_name)
     """
     
     
-    # read the dataset
+    # read the dataset, the time columns, death, and RANDID are not loaded at all
     if df is  None:
-        df = deepcopy(pd.read_csv(data_path))
+        df = read_data(data_path)
     
-    # if there are time columns, death, and RANDID, remove them
-    try:
-        df = df[[col for col in df.columns if not re.match('TIME',col) and col not in ['RANDID','DEATH']]]
-    except:
-        pass
+    # if there are time columns, death, and RANDID, remove them (needed only when df is passed in)
+    df = _drop_unused_columns(df)
     
     # get the features
     features = list(df.columns)
@@ -74,17 +423,25 @@ def balance_impute_data(balancer,imputer,data_path=None,df=None,test_size=.2,tar
     # quit()
     features.remove(target)
     
-    # get counts of each feature unique value, if the unique values are less than 5, they are considered as categorical (this works only for this dataset, it is not a general rule)
-    counts = df[features].nunique().to_frame().reset_index().rename(columns={"index":"Feature",0:"N Uniques"})
+    # positions of the categorical and numerical features in X, used for both the names and the assignment
+    if col_split is None:
+        col_split = split_columns(df,target=target)
+    
+    cat_idx,num_idx,rest_idx = col_split
+    
+    cat_varaibles = [features[i] for i in cat_idx]
+    num_varaiables = [features[i] for i in num_idx]
     
-    cat_varaibles = counts[counts['N Uniques'] < 5]['Feature'].values
-    num_varaiables = counts[counts['N Uniques'] > 5]['Feature'].values
+    # prepare data: X is allocated once and filled by position, so no copies of df are needed
+    X = np.empty((len(df),len(features)),dtype=np.float32)
+    y = df[target].to_numpy(copy=False)
     
-    # prepare data
+    # a binary target fits in int8
+    if np.isin(y,(0,1)).all():
+        y = y.astype(np.int8)
     
-    ddf  = df.copy()
-    x_cat = df[cat_varaibles].copy()
-    x_num = df[num_varaiables].copy()
+    # features with exactly 5 unique values are neither categorical nor numerical, they are kept as they are
+    X[:,rest_idx] = df[[features[i] for i in rest_idx]].to_numpy(dtype=np.float32,copy=False)
         
 
     # impute missings
@@ -94,51 +451,82 @@ def balance_impute_data(balancer,imputer,data_path=None,df=None,test_size=.2,tar
     cat_imputer_name,cat_imputer = imputer[2],imputer[3]    
     # impute, the first version of imputing was using entire data, the split
     # this time we are going to split, then impute
-    x_cat = cat_imputer.fit_transform(x_cat)
-    x_num = num_imputer.fit_transform(x_num)
-    
-    # 
-    ddf[cat_varaibles] = x_cat
-    ddf[num_varaiables] = x_num
-    
-    X,y = ddf[features].values,ddf[target].values
+    # mean and mode imputation are done in place with numpy, np.array makes sure df is not modified
+    X[:,cat_idx] = _impute(np.array(df[cat_varaibles],dtype=np.float32),cat_imputer_name,cat_imputer,cat_varaibles)
+    X[:,num_idx] = _impute(np.array(df[num_varaiables],dtype=np.float32),num_imputer_name,num_imputer,num_varaiables)
         
         
     # balance
     
-    try:
-        balancer_name = balancer.__name__
-        balancer = balancer()
-        X,y = balancer.fit_resample(X,y)
-    except:
+    # None means the original (unbalanced) data is used
+    if balancer is None:
         balancer_name = 'OriginalData'
+    else:
+        balancer_name = balancer.__name__
+        X,y = balancer().fit_resample(X,y)
     
+    # some balancers (e.g. smote_variants) return float64, keep float32 for the split and scaling
+    X = X.astype(np.float32,copy=False)
     
-    # split
-    X_train,X_test,y_train,y_test = train_test_split(X,y,random_state=123,test_size=test_size)
-
-    # scale
-    scaler = StandardScaler()
     
-    scaler = scaler.fit(X_train)
-    X_train = scaler.transform(X_train)
-    X_test = scaler.transform(X_test)
+    # split and scale, see split_and_scale
+    X_train,X_test,y_train,y_test = split_and_scale(X,y,scale_idx=np.sort(np.concatenate([num_idx,rest_idx])),test_size=test_size)
     
     
     # if save:
         
     #     try:
     
-    return X_train,X_test,y_train,y_test,cat_imputer_name,num_imputer_name,balancer_name
+    return PreparedData(X_train,X_test,y_train,y_test,cat_imputer_name,num_imputer_name,balancer_name)
+
 
 
+def _prepare_cached(df,imputer,balancer,col_split=None):
+    
+    """
+    balance_impute_data with a small LRU cache, so algorithms that share the same imputers and balancer reuse the prepared data.
+    
+    The key is (id(df), num imputer name, cat imputer name, balancer). The cache keeps a reference to df,
+    so its id cannot be reused by another DataFrame while the entry is cached; df should not be modified in place.
+    The cached arrays are made read-only since they are shared between the callers.
+    """
     
+    key = (id(df),imputer[0],imputer[2],balancer)
     
+    if key in _PREPARED_CACHE:
+        _PREPARED_CACHE.move_to_end(key)
+        return _PREPARED_CACHE[key][1]
     
-def prepare_for_algorithm(algorithm,df,performances_df,by_features=['Algorithm','Metric'],by_metric='AUC',by_set='Test'):
+    prepared = balance_impute_data(balancer=balancer,imputer=imputer,df=df,col_split=col_split)
+    
+    return _cache_prepared(key,df,prepared)
+
+
+
+def _cache_prepared(key,df,prepared):
+    
+    """
+    Stores prepared data in the cache (see _prepare_cached), makes its arrays read-only, and returns it.
+    """
+    
+    for array in prepared[:4]:
+        array.flags.writeable = False
+    
+    _PREPARED_CACHE[key] = (df,prepared)
+    
+    if len(_PREPARED_CACHE) > _PREPARED_CACHE_SIZE:
+        _PREPARED_CACHE.popitem(last=False)
+    
+    return prepared
+
+
+
+def prepare_for_algorithm(algorithm,df,performances_df,by_features=['Algorithm','Metric'],by_metric='AUC',by_set='Test',combinations=None,col_split=None):
     
     """
     Prepare the data for a specific algorithm.
+    The prepared data is cached by df and the imputers and balancer names (see _prepare_cached), 
+    so the returned arrays are read-only and df should not be modified in place between calls.
     
     Parameters:
     -----------
@@ -160,19 +548,87 @@ def prepare_for_algorithm(algorithm,df,performances_df,by_features=['Algorithm',
     by_set: str
         The set to use for grouping. The default value is 'Test'
         
+    combinations: dict
+        The combinations returned by get_combinations with return_dict=True. The default value is None.
+        If None, the combinations are computed from performances_df.
+        
+    col_split: tuple
+        The categorical/numerical features split as returned by split_columns. The default value is None.
+        If None, it is computed from df.
+        
     Returns:
     --------
-    tuple
-        A tuple with the train and test sets and the names of the imputers and balancer.  
+    PreparedData
+        A namedtuple with the train and test sets and the names of the imputers and balancer.  
         (X_train,X_test,y_train,y_test,cat_imputer_name,num_imputer_name,balancer_name)
     """
     
-    combinations = get_combinations(df=performances_df,by_features=by_features,by_metric=by_metric,by_set=by_set,return_dict=True)
+    if combinations is None:
+        combinations = get_combinations(df=performances_df,by_features=by_features,by_metric=by_metric,by_set=by_set,return_dict=True)
     
     combination = combinations[algorithm]
     
     _,imputer,balanc = combination
     
-    X_train,X_test,y_train,y_test,cat_imputer_name,num_imputer_name,balancer_name = balance_impute_data(balancer=balanc,imputer=imputer,df=df)
+    return _prepare_cached(df,imputer,balanc,col_split=col_split)
+
+
+
+def prepare_all(df,performances_df,algorithms,by_features=['Algorithm','Metric'],by_metric='AUC',by_set='Test',n_jobs=-1):
+    
+    """
+    Prepare the data for several algorithms in parallel using joblib.
+    The combinations and the features split are computed once here. The algorithms are grouped by 
+    (num imputer name, cat imputer name, balancer), so each distinct combination is prepared by one process only,
+    and algorithms sharing a combination share the same (read-only) PreparedData.
+    The results are also stored in the cache of this process, so later prepare_for_algorithm calls with the same df reuse them.
+    
+    Parameters:
+    -----------
+    df: pd.DataFrame
+        The data.
+
+    performances_df: pd.DataFrame
+        The performances DataFrame.
+        
+    algorithms: list
+        The algorithms names.
+        
+    by_features, by_metric, by_set:
+        See prepare_for_algorithm.
+        
+    n_jobs: int
+        The number of jobs to run in parallel. The default value is -1 (all cores).
+        
+    Returns:
+    --------
+    list of PreparedData
+        One PreparedData per algorithm, in the same order as algorithms (see prepare_for_algorithm).
+    """
+    
+    combinations = get_combinations(df=performances_df,by_features=by_features,by_metric=by_metric,by_set=by_set,return_dict=True)
+    col_split = split_columns(df)
+    
+    # one job per distinct (imputers, balancer), keeping the first imputer instances seen for each key
+    keys = {}
+    for algorithm in algorithms:
+        _,imputer,balancer = combinations[algorithm]
+        keys.setdefault((id(df),imputer[0],imputer[2],balancer),(imputer,balancer))
+    
+    # keys already prepared in this process are not sent to the workers
+    prepared = {key:_PREPARED_CACHE[key][1] for key in keys if key in _PREPARED_CACHE}
+    missing = [key for key in keys if key not in prepared]
+    
+    results = Parallel(n_jobs=n_jobs,prefer='processes')(delayed(balance_impute_data)(balancer=keys[key][1],imputer=keys[key][0],df=df,col_split=col_split) for key in missing)
+    
+    for key,result in zip(missing,results):
+        prepared[key] = _cache_prepared(key,df,result)
+    
+    # map the results back in the order of algorithms
+    
+    output = []
+    for algorithm in algorithms:
+        _,imputer,balancer = combinations[algorithm]
+        output.append(prepared[(id(df),imputer[0],imputer[2],balancer)])
     
-    return X_train,X_test,y_train,y_test,cat_imputer_name,num_imputer_name,balancer_name
\ No newline at end of file
+    return output
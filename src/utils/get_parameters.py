@@ -1,6 +1,7 @@
 """
-This file contains three functions:
+This file contains four functions:
     
+        - iter_params: to lazily yield hyperparameters combinations as dictionaries
         - get_params: to get hyperparameters combinations for the algorithms
         - max_score_for_each: to get the best score for each algorithm for each metric
         - get_combinations: to get the combinations of imputers, balancers, and algorithms that worked best for a given metric
@@ -10,7 +11,9 @@ The functions in this file are used to entire algorithm optimization process mor
 """
 
 
-from itertools import product
+from functools import lru_cache
+import os
+from itertools import chain,product
 import numpy as np
 import pandas as pd
 
@@ -31,6 +34,80 @@ from imblearn.under_sampling import ClusterCentroids,AllKNN
 from sklearn.impute import SimpleImputer, KNNImputer
 
 
+# maps from the names used in the performance data to the classes
+# imputers are factories, called in _combinations_from_names after the names cache lookup,
+# so every get_combinations call gets its own (unfitted) instances
+_IMPUTER_MAP = {
+    'KNNImptuer':lambda: KNNImputer(),
+    'SimpleImputer_mode':lambda: SimpleImputer(strategy='most_frequent'),
+    'SimpleImputer_mean':lambda: SimpleImputer()
+}
+
+_ALGO_MAP = {
+    'NaiveBayes':GaussianNB,
+    'KNN':KNeighborsClassifier,
+    'DecisionTree':DecisionTreeClassifier,
+    'LogisticRegression':LogisticRegression,
+    'Bagging':BaggingClassifier,
+    'SVM':SVC,
+    'RandomForest':RandomForestClassifier,
+    'XGBoost':XGBClassifier,
+    'GradientBoosting':GradientBoostingClassifier
+}
+
+_BALANCER_MAP = {
+    "SMOTE":SMOTE,
+    "MWMOTE":MWMOTE,
+    "OriginalData":None,
+    "ClusterCentroids":ClusterCentroids,
+    "AllKNN":AllKNN,
+    "ADASYN":ADASYN
+}
+
+
+
+# penalties supported by each LogisticRegression solver (from the sklearn documentation)
+_LOG_SOLVER_PENALTIES = {
+    'lbfgs':('l2',None),
+    'liblinear':('l1','l2'),
+    'newton-cg':('l2',None),
+    'newton-cholesky':('l2',None),
+    'sag':('l2',None),
+    'saga':('l1','l2','elasticnet',None)
+}
+
+
+
+def iter_params(names,value_lists,is_valid=None):
+    
+    """
+    Lazily yields hyperparameters combinations as dictionaries.
+    
+    Parameters:
+    -----------
+    names: list
+        The hyperparameters names.
+    value_lists: list of lists
+        The values of each hyperparameter, in the same order as names.
+    is_valid: callable
+        A function that takes a combination dictionary and returns False if the combination should be skipped.
+        The default value is None, which means that all combinations are yielded.
+        
+    Yields:
+    -------
+    dict
+        A hyperparameters combination.
+    """
+    
+    for combo in product(*value_lists):
+        
+        params = dict(zip(names,combo))
+        
+        if is_valid is None or is_valid(params):
+            yield params
+
+
+
 def get_params(algoritm=None):
     
     
@@ -40,9 +117,10 @@ def get_params(algoritm=None):
     
     The steps are (for each algorithm):
         - define the hyperparameters and their values in lists
-        - create a list of lists where each list is a combination of hyperparameters (using itertools.product)
-        - create a list of dictionaries where each dictionary is a hyperparameters combination (lambda function get_param_dict)
-        - return the list of dictionaries
+        - return a generator of dictionaries where each dictionary is a hyperparameters combination (iter_params function)
+        
+    For LogisticRegression, the penalty and solver combinations that are not supported by sklearn are skipped,
+    and l1_ratio is only combined with the elasticnet penalty (the only one that uses it).
     
     
     Parameters:
@@ -61,8 +139,8 @@ def get_params(algoritm=None):
             - XGBClassifier (xgboost.XGBClassifier)
     Returns:
     --------
-    list of dicts
-        A list of dictionaries with hyperparameters combinates for the algorithm (list of dicts). 
+    generator of dicts
+        A generator of dictionaries with hyperparameters combinates for the algorithm. Wrap it with list(...) if a list is needed.
         If the algorithm name is not valide (from the list above), a ValueError is raised.
     """
     
@@ -70,9 +148,6 @@ def get_params(algoritm=None):
     
     
     
-    # this lambda functions create a list of dictionaries for hyperparameters combinations
-    get_param_dict = lambda names,params: [{names[j]:params_comb[j] for j in range(len(names))} for params_comb in params]
-    
     match algoritm:
         case "LogisticRegression":
             
@@ -84,10 +159,17 @@ def get_params(algoritm=None):
 
 
 
-            log_params = list(product(log_penalties,log_Cs,log_solvers,log_max_iters,log_l1_ratios))
-            log_params_names = ["penalty","C","solver","max_iter","l1_ratio"]
+            # l1_ratio is only used by the elasticnet penalty, so it is added only to the elasticnet grid
+            log_params = [[penalty for penalty in log_penalties if penalty != 'elasticnet'],log_Cs,log_solvers,log_max_iters]
+            log_params_names = ["penalty","C","solver","max_iter"]
+            
+            log_elasticnet_params = [['elasticnet'],log_Cs,log_solvers,log_max_iters,log_l1_ratios]
+            log_elasticnet_params_names = log_params_names + ["l1_ratio"]
+            
+            is_valid = lambda params: params['penalty'] in _LOG_SOLVER_PENALTIES[params['solver']]
 
-            log_params_dict = get_param_dict(log_params_names,log_params)
+            log_params_dict = chain(iter_params(log_params_names,log_params,is_valid=is_valid),
+                                    iter_params(log_elasticnet_params_names,log_elasticnet_params,is_valid=is_valid))
             
             return log_params_dict
         
@@ -101,14 +183,14 @@ def get_params(algoritm=None):
             tree_max_features = [10,15,"sqrt", "log2"]
             tree_random_state = [123,None]
 
-            tree_params = list(product(tree_criterion,tree_splitter,tree_max_depth,tree_min_samples_split,
-                                            tree_min_samples_leaf,tree_max_features,tree_random_state))
+            tree_params = [tree_criterion,tree_splitter,tree_max_depth,tree_min_samples_split,
+                                            tree_min_samples_leaf,tree_max_features,tree_random_state]
 
 
             tree_params_names = ["criterion","splitter","max_depth","min_samples_split","min_samples_leaf","max_features","random_state"]
 
 
-            tree_params_dict = get_param_dict(tree_params_names,tree_params)
+            tree_params_dict = iter_params(tree_params_names,tree_params)
             
             return tree_params_dict
         
@@ -123,10 +205,10 @@ def get_params(algoritm=None):
             svm_decision_function_shape = ['ovo', 'ovr']
             svm_random_state = [123,None]
             
-            svm_params = list(product(svm_C,svm_kernel,svm_degree,svm_gamma,svm_coef0,svm_decision_function_shape,svm_random_state))
+            svm_params = [svm_C,svm_kernel,svm_degree,svm_gamma,svm_coef0,svm_decision_function_shape,svm_random_state]
             svm_params_names = ["C","kernel","degree","gamma","coef0","decision_function_shape","random_state"]
             
-            svm_params_dict = get_param_dict(svm_params_names,svm_params)
+            svm_params_dict = iter_params(svm_params_names,svm_params)
             
             return svm_params_dict
         
@@ -138,10 +220,10 @@ def get_params(algoritm=None):
             knn_algorithm = ['auto', 'ball_tree', 'kd_tree', 'brute']
             knn_p = [1,2,3]
             
-            knn_params =list(product(knn_n_neighbors,knn_weights,knn_algorithm,knn_p))
+            knn_params = [knn_n_neighbors,knn_weights,knn_algorithm,knn_p]
             knn_params_names = ['n_neighbors','weights','algorithm','p']
             
-            knn_params_dict = get_param_dict(knn_params_names,knn_params)
+            knn_params_dict = iter_params(knn_params_names,knn_params)
 
             
             return knn_params_dict
@@ -154,10 +236,10 @@ def get_params(algoritm=None):
             forest_min_samples_split = [2,4,6]
             forest_min_samples_leaf = [1,2,3]
             
-            forest_params =list(product(forest_n_estimators,forest_criterion,forest_max_features,forest_min_samples_split,forest_min_samples_leaf))
+            forest_params = [forest_n_estimators,forest_criterion,forest_max_features,forest_min_samples_split,forest_min_samples_leaf]
             forest_params_names = ['n_estimators','criterion','max_features','min_samples_split','min_samples_leaf']
             
-            forest_params_dict = get_param_dict(forest_params_names,forest_params)
+            forest_params_dict = iter_params(forest_params_names,forest_params)
 
 
             return forest_params_dict
@@ -173,11 +255,11 @@ def get_params(algoritm=None):
             gradient_min_samples_split = [2,4,6]
             gradient_min_samples_leaf = [1,2,3]
             
-            gradient_params =list(product(gradient_loss,gradient_learning_rate,gradient_n_estimators,\
-                                    gradient_subsample,gradient_criterion,gradient_max_features,gradient_min_samples_split,gradient_min_samples_leaf))
+            gradient_params = [gradient_loss,gradient_learning_rate,gradient_n_estimators,\
+                                    gradient_subsample,gradient_criterion,gradient_max_features,gradient_min_samples_split,gradient_min_samples_leaf]
             gradient_params_names = ['loss','learning_rate','n_estimators','subsample','criterion','max_features','min_samples_split','min_samples_leaf']
             
-            gradient_params_dict = get_param_dict(gradient_params_names,gradient_params)
+            gradient_params_dict = iter_params(gradient_params_names,gradient_params)
 
 
             return gradient_params_dict
@@ -189,10 +271,10 @@ def get_params(algoritm=None):
             bagging_bootstrap_features = [True,False]
             
             
-            bagging_params =list(product(bagging_n_estimators,bagging_oob_score,bagging_bootstrap_features))
+            bagging_params = [bagging_n_estimators,bagging_oob_score,bagging_bootstrap_features]
             bagging_params_names = ['n_estimators','oob_score','bootstrap_features']
             
-            bagging_params_dict = get_param_dict(bagging_params_names,bagging_params)
+            bagging_params_dict = iter_params(bagging_params_names,bagging_params)
             
             return bagging_params_dict
 
@@ -204,10 +286,10 @@ def get_params(algoritm=None):
             xg_max_depth = [3,5,7,10]
             xg_max_leaves = [3,5,7,0]
             
-            xg_params =list(product(xg_n_estimators,xg_learning_rate,xg_subsample,xg_max_depth,xg_max_leaves))
+            xg_params = [xg_n_estimators,xg_learning_rate,xg_subsample,xg_max_depth,xg_max_leaves]
             xg_params_names = ['n_estimators','learning_rate','subsample','max_depth','max_leaves']
             
-            xg_params_dict= get_param_dict(xg_params_names,xg_params)
+            xg_params_dict= iter_params(xg_params_names,xg_params)
             
             return xg_params_dict
         
@@ -216,7 +298,7 @@ def get_params(algoritm=None):
             naive_priors = None
             naive_var_smoothing  = 1e-9
             
-            return [{'priors':naive_priors,'var_smoothing':naive_var_smoothing}]
+            return iter_params(['priors','var_smoothing'],[[naive_priors],[naive_var_smoothing]])
             
 
         case _:
@@ -234,7 +316,7 @@ def max_score_for_each(df,by=['Algorithm','Metric'],set_='Test'):
 
     """
     This function returns the best score for each algorithm for each metric.
-    The function groups the data by the 'by' parameter(s) and then gets the maximum score for each group.
+    The function groups the data by the 'by' parameter(s) and then gets the row with the maximum score for each group.
     
     Parameters:
     -----------
@@ -252,10 +334,11 @@ def max_score_for_each(df,by=['Algorithm','Metric'],set_='Test'):
     
     """
 
-    get_max_score = lambda group: group.loc[group['Score'].idxmax()]
-
     df_set = df[df['Set'] == set_]
-    max_scores = df_set.groupby(by).apply(get_max_score).reset_index(drop=True)
+    
+    # index of the best row in each group, then a single gather of those rows
+    idx = df_set.groupby(by,sort=False,observed=True)['Score'].idxmax()
+    max_scores = df_set.loc[idx].reset_index(drop=True)
 
     return max_scores
 
@@ -273,13 +356,16 @@ def get_combinations(performance_path = './results/general/full_data_performance
         - read the performance data (in cartesian product format, which means that each algorithm has all the combinations of imputers and balancers)
         - get the best score for each algorithm for each metric (using max_score_for_each function from this file)
         - filter the data by the given metric: this is the metric that we consider the primary metric to get the best combinations
-        - use predefiend dictionaries to map the algorithm, imputer, and balancer names to the classes: this is 
+        - use predefiend module level dictionaries to map the algorithm, imputer, and balancer names to the classes: this is 
             necessary to convert strings to classes, so enable the use of the classes in the pipeline
         - crete a list of lists: the length of the list is equal to the numbder of algorithms, 
             and each lists consists of [algorithm, [num_imputer_name,num_imputer,cat_imputer_name,cat_imputer],balancer]]
             the algorithm and balancer are classes, but the imputers are tuples with the name and the instantiated class
         - return the list of lists
         
+    When the performance data is read from performance_path, the best names are cached (see _build_name_rows),
+    so calling the function repeatedly in a loop over algorithms reads and groups the csv only once (until the csv is rewritten).
+        
         
     Parameters:
     -----------
@@ -305,60 +391,72 @@ def get_combinations(performance_path = './results/general/full_data_performance
         A list of lists with the best combinations of algorithm, imputer, and balancer for a given metric.
     """
     
-    imputer_map = {
-        'KNNImptuer':KNNImputer(),
-        'SimpleImputer_mode':SimpleImputer(strategy='most_frequent'),
-        'SimpleImputer_mean': SimpleImputer()
-    }
+    if df is None:
+        # the modification time is part of the cache key, so a rewritten csv is read again
+        rows = _build_name_rows(performance_path,os.path.getmtime(performance_path),by_metric,by_set,tuple(by_features))
+    else:
+        rows = _name_rows_from_performances(df,by_features,by_metric,by_set)
+    
+    # the classes and imputers are built after the cache lookup, so every call gets new (unfitted) imputers
+    combinations = _combinations_from_names(rows)
+    
+    if return_dict:
+        return {combination[0].__name__:combination for combination in combinations}
+    
+    return combinations
+
 
-    algorithm_map = {
-    'NaiveBayes':GaussianNB,
-    'KNN':KNeighborsClassifier,
-    'DecisionTree':DecisionTreeClassifier,
-    'LogisticRegression':LogisticRegression,
-    'Bagging':BaggingClassifier,
-    'SVM':SVC,
-    'RandomForest':RandomForestClassifier,
-    'XGBoost':XGBClassifier,
-    'GradientBoosting':GradientBoostingClassifier
-    }
 
-    balancer_map = {
-        "SMOTE":SMOTE,
-        "MWMOTE":MWMOTE,
-        "OriginalData":None,
-        "ClusterCentroids":ClusterCentroids,
-        "AllKNN":AllKNN,
-        "ADASYN":ADASYN
-    }
+@lru_cache(maxsize=8)
+def _build_name_rows(performance_path,mtime,by_metric,by_set,by_features):
     
-    if df is None:
-        df = pd.read_csv(performance_path)
-        
+    """
+    Cached version of _name_rows_from_performances for the performance data read from a csv file.
+    The arguments are hashable (by_features is a tuple) and mtime is the file modification time, 
+    so the csv is read and grouped only once per set of arguments and file version.
+    Only the names are cached (as tuples), never the classes instances.
+    """
+    
+    df = pd.read_csv(performance_path)
+    
+    return tuple(_name_rows_from_performances(df,list(by_features),by_metric,by_set))
+
+
+
+def _name_rows_from_performances(df,by_features,by_metric,by_set):
+    
+    """
+    Returns the best (algorithm, num imputer, cat imputer, balancer) names from the performance data (see get_combinations).
+    """
     
     data = max_score_for_each(df,by=by_features,set_=by_set)
     
     data = data[data['MainMetric'] == by_metric]
     
-    data.reset_index(drop=True,inplace=True)
-    
+    # no rows for this metric: str.split(expand=True) would return a frame without columns
+    if data.empty:
+        return []
     
-    hyper_dict = data[['Algorithm','Imputer','Imbalance']].to_dict()
-    hyper_dict = {key.lower():list(value.values()) for key,value in hyper_dict.items()}
+    # imputer names are stored as "<numerical>__<categorical>"
+    imputers = data['Imputer'].str.split("__",expand=True)
 
-    hyper_dict['imputer'] = [im.split("__") for im in hyper_dict['imputer']]
-    hyper_dict['imputer'] = [[imp[0],imputer_map[imp[0]],imp[1],imputer_map[imp[1]]] for imp in hyper_dict['imputer']]
-    hyper_dict['imbalance'] = [balancer_map[val] for val in hyper_dict['imbalance']]
-    hyper_dict['algorithm'] = [algorithm_map[alg] for alg in hyper_dict['algorithm']]
+    return list(zip(data['Algorithm'],imputers[0],imputers[1],data['Imbalance']))
 
-    combinations = [[hyper_dict[key][i] for key in hyper_dict] for i in range(len(hyper_dict['algorithm']))]
-    
-    combinations_dict = {combinations[i][0].__name__:combinations[i] for i in range(len(combinations))}
-    
+
+
+def _combinations_from_names(rows):
     
-    if return_dict:
-        return combinations_dict
+    """
+    Maps the names returned by _name_rows_from_performances to the classes and new imputer instances.
+    Returns a list of (algorithm, [num_imputer_name,num_imputer,cat_imputer_name,cat_imputer], balancer).
+    """
     
-    return combinations
+    algorithms = [_ALGO_MAP[algorithm_name] for algorithm_name,_,_,_ in rows]
 
+    # _BALANCER_MAP has None values (OriginalData), so it is looked up directly rather than with Series.map
+    combinations = [
+        (algorithm,[num_name,_IMPUTER_MAP[num_name](),cat_name,_IMPUTER_MAP[cat_name]()],_BALANCER_MAP[balancer_name])
+        for algorithm,(_,num_name,cat_name,balancer_name) in zip(algorithms,rows)
+    ]
     
+    return combinations
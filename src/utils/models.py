@@ -21,12 +21,12 @@ sys.path.append("../")
 
 from utils.get_parameters import get_combinations,get_params
 from utils.metrics import  get_performances
-from utils.data_preparation import balance_impute_data
+from utils.data_preparation import balance_impute_data,split_columns,read_data
 
 
 
 
-def find_best_model(algorithm,balancer,data_path=None,df=None,target='CVD',test_size=.2,imputer=None,ovewrite=False):
+def find_best_model(algorithm,balancer,data_path=None,df=None,target='CVD',test_size=.2,imputer=None,ovewrite=False,col_split=None):
     
     
     """
@@ -79,6 +79,10 @@ def find_best_model(algorithm,balancer,data_path=None,df=None,target='CVD',test_
         If True, the function will overwrite the results if they already exist. The default value is False.
         If False, the function will ask the user if they want to overwrite the results if they already exist.
         
+    col_split: tuple
+        The categorical/numerical features split as returned by split_columns. The default value is None.
+        If None, it is computed from the data.
+        
     Returns:
     --------
     tuple
@@ -101,7 +105,7 @@ def find_best_model(algorithm,balancer,data_path=None,df=None,target='CVD',test_
     algorithm_name = algorithm.__name__
     
     try:
-        parameters = get_params(algorithm_name)
+        parameters = list(get_params(algorithm_name))
     except:
         print("Model not found!!")
         return None,None,None
@@ -124,7 +128,7 @@ def find_best_model(algorithm,balancer,data_path=None,df=None,target='CVD',test_
     # read the data if df is None
     if df is None:
             
-        df = pd.read_csv(data_path)
+        df = read_data(data_path)
     
     
     # get the data ready for modeling
@@ -132,7 +136,8 @@ def find_best_model(algorithm,balancer,data_path=None,df=None,target='CVD',test_
                                                                                                         balancer=balancer,
                                                                                                         imputer=imputer,
                                                                                                         test_size=test_size,
-                                                                                                        target=target)
+                                                                                                        target=target,
+                                                                                                        col_split=col_split)
     
 
     # number of hyperparameters
@@ -277,10 +282,13 @@ def train_best_models(df=None,data_path=None):
         
     """
     
-    df = pd.read_csv(data_path) if df is None else df   
+    df = read_data(data_path) if df is None else df   
     
     #  get combinations of model,balance,imputer
     combinations = get_combinations()
+    
+    # the data is the same for all the algorithms, so the features split is computed once
+    col_split = split_columns(df)
 
     
     best_results_for_all_models = None
@@ -289,12 +297,13 @@ def train_best_models(df=None,data_path=None):
 
         algorithm, imputer,balanc = combination
 
-        print(algorithm.__name__,balanc.__name__,imputer)
+        print(algorithm.__name__,'OriginalData' if balanc is None else balanc.__name__,imputer)
 
         best_model,best_params,output = find_best_model(algorithm=algorithm,
                                                     balancer=balanc,
                                                     imputer=imputer,
-                                                    df=df)
+                                                    df=df,
+                                                    col_split=col_split)
 
         if best_results_for_all_models is None:
             best_results_for_all_models = output
@@ -202,10 +202,10 @@ def train_models(path_to_save,path=None,df=None,target_var="CVD"):
             
             X_train,X_test,y_train,y_test = train_test_split(X_balanced,y_balaanced,random_state=123,test_size=.2)
             
-            scaler = StandardScaler()
+            # X_train and X_test are new arrays from train_test_split, so they are scaled in place
+            scaler = StandardScaler(copy=False)
             
-            scaler = scaler.fit(X_train)
-            X_train = scaler.transform(X_train)
+            X_train = scaler.fit_transform(X_train)
             X_test = scaler.transform(X_test)
             
             
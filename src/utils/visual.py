@@ -363,6 +363,10 @@ def plot_results(performances_df,algorithm,df,set_='Test'):
     """
     Plot best results for a specific algorithm.
     
+    The model is loaded from ../models and evaluated on the output of prepare_for_algorithm, so it must have been trained 
+    with the current data preparation (stratified split, only non-categorical features scaled). 
+    Models saved before that change give wrong metrics, regenerate them with main.py first.
+    
     Parameters:
     -----------
     performances_df: pd.DataFrame